@@ -1,7 +1,13 @@
 import os
+import sys
+import json
+import uuid
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
+# Routing and scheduling decisions are logged at INFO
+logging.basicConfig(level=os.getenv("HCA_LOG_LEVEL", "INFO"), format="%(asctime)s %(name)s %(levelname)s %(message)s")
 
 # os.environ['CUDA_VISIBLE_DEVICES'] = '-1'
 # os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -9,15 +15,28 @@ load_dotenv()
 import streamlit as st
 import transformers
 from data import MEDICATIONS, DISCLAIMER
+from retrieval import get_index, retrieve_context
+from scheduler import GenerationScheduler, Overloaded
+from cache import cache_get, cache_set, archive_messages, count_archived, load_archived
 from utils import (
     is_emergency, 
     find_medications, 
     get_medication_details, 
+    medication_details,
     check_interaction, 
-    analyze_symptoms,
+    openfda_lookup,
     analyze_wellness,
     normalize,
-    infermedica_triage
+    infermedica_triage,
+    find_symptoms,
+    describe_symptoms,
+    new_conversation_memory,
+    remember,
+    turn_medications,
+    summarize_conversation,
+    classify_intent,
+    render_lookup,
+    record_route
 )
 
 # Page Configuration must be the first streamlit command
@@ -27,12 +46,30 @@ st.set_page_config(
     layout="wide"
 )
 
+# Chat turns kept in session memory; older turns are spilled to the on-disk archive
+MAX_CHAT_HISTORY = 40
+# Turns rendered per page of the chat view
+HISTORY_PAGE_SIZE = 20
+
 # Initialize global state
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'history_visible' not in st.session_state:
+    st.session_state.history_visible = HISTORY_PAGE_SIZE
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = new_conversation_memory()
 if 'profile' not in st.session_state:
     st.session_state.profile = {"name": "Guest", "age": 30, "conditions": ""}
 
+def model_kwargs():
+    # In shared mode weights are loaded from safetensors without an extra in-memory copy,
+    # so the read-only pages are memory-mapped and shared by replicas through the OS page cache.
+    if os.getenv("HCA_SHARED_MODEL", "").lower() in {"1", "true", "yes"}:
+        return {"use_safetensors": True, "low_cpu_mem_usage": True}
+    return {}
+
 # Load Model (Cached)
 @st.cache_resource
 def load_model():
@@ -40,12 +77,12 @@ def load_model():
     # Try using a different model that's more compatible with deployment environments
     try:
         # First try the original FLAN-T5 model
-        return transformers.pipeline("text2text-generation", model="google/flan-t5-base")
+        return transformers.pipeline("text2text-generation", model="google/flan-t5-base", model_kwargs=model_kwargs())
     except Exception as e:
         # If that fails, try a different model that doesn't require sentencepiece
         try:
             # Using a BART model instead which doesn't require sentencepiece
-            return transformers.pipeline("text2text-generation", model="facebook/bart-large-cnn")
+            return transformers.pipeline("text2text-generation", model="facebook/bart-large-cnn", model_kwargs=model_kwargs())
         except Exception as e2:
             # If all else fails, return None and handle gracefully
             st.error(f"Error loading local AI model: {e}, {e2}")
@@ -148,10 +185,57 @@ def generate_via_groq(prompt: str) -> str | None:
     except Exception:
         return None
 
+# Responses that signal a failure rather than an answer are never shared through the cache
+UNCACHED_RESPONSES = (
+    "AI model is currently unavailable.",
+    "Local model is unavailable.",
+    "I am unable to generate a response",
+)
+
+@st.cache_resource
+def get_scheduler():
+    # Shared by every session in this server process
+    return GenerationScheduler(
+        concurrency={"Local (FLAN-T5-Base)": int(os.getenv("HCA_LOCAL_CONCURRENCY", "1"))},
+        default_concurrency=int(os.getenv("HCA_CLOUD_CONCURRENCY", "4")),
+        max_queue=int(os.getenv("HCA_MAX_QUEUE", "16")),
+        session_rpm=float(os.getenv("HCA_SESSION_RPM", "12")),
+        backend_rpm=float(os.getenv("HCA_BACKEND_RPM", "60")),
+        timeout=float(os.getenv("HCA_QUEUE_TIMEOUT", "60")),
+    )
+
 def generate_ai_response(user_input: str, context: str = "") -> str:
+    """Generate a reply through the scheduler; raises Overloaded when the request is shed."""
+    backend = st.session_state.get("model_backend", "Local (FLAN-T5-Base)")
+    cache_key = json.dumps([backend, user_input, context])
+    cached = cache_get("response", cache_key)
+    if cached is not None:
+        return cached
+
+    # The local model is the cheaper fallback when a cloud backend is out of budget
+    backends = [backend]
+    if backend != "Local (FLAN-T5-Base)" and text_generator:
+        backends.append("Local (FLAN-T5-Base)")
+    queue_status = st.empty()
+    try:
+        with get_scheduler().slot(
+            st.session_state.session_id,
+            backends,
+            on_wait=lambda position: queue_status.info(f"⏳ High demand right now - you are #{position} in the queue."),
+        ) as granted:
+            queue_status.empty()
+            response = _generate_ai_response(user_input, context, granted)
+    finally:
+        queue_status.empty()
+
+    # Stored under the key it is looked up by; fallback answers are not cached for the preferred backend
+    if granted == backend and not response.startswith(UNCACHED_RESPONSES):
+        cache_set("response", cache_key, response)
+    return response
+
+def _generate_ai_response(user_input: str, context: str, backend: str) -> str:
     if not text_generator:
         # If local model is unavailable, try to use cloud-based models
-        backend = st.session_state.get("model_backend", "Local (FLAN-T5-Base)")
         if backend != "Local (FLAN-T5-Base)":
             # If user has selected a cloud model, try that instead
             prompt = (
@@ -192,7 +276,6 @@ def generate_ai_response(user_input: str, context: str = "") -> str:
         )
     
     try:
-        backend = st.session_state.get("model_backend", "Local (FLAN-T5-Base)")
         if backend == "Local (FLAN-T5-Base)":
             if text_generator:
                 out = text_generator(
@@ -214,15 +297,15 @@ def generate_ai_response(user_input: str, context: str = "") -> str:
                     f"Question: {user_input} "
                     "Answer:"
                 )
-                if st.session_state.get("model_backend") == "OpenAI (gpt-4o-mini)":
+                if backend == "OpenAI (gpt-4o-mini)":
                     r = generate_via_openai(prompt)
                     if r:
                         return r
-                elif st.session_state.get("model_backend") == "Anthropic (Claude 3.5)":
+                elif backend == "Anthropic (Claude 3.5)":
                     r = generate_via_anthropic(prompt)
                     if r:
                         return r
-                elif st.session_state.get("model_backend") == "Groq (Llama-3.1-70B)":
+                elif backend == "Groq (Llama-3.1-70B)":
                     r = generate_via_groq(prompt)
                     if r:
                         return r
@@ -258,6 +341,55 @@ def generate_ai_response(user_input: str, context: str = "") -> str:
     except Exception:
         return "I am unable to generate a response at this moment."
 
+def build_context(user_input: str, memory: dict, symptoms: list, wellness_advice: str, meds: list, triage: dict) -> str:
+    context_parts = []
+    summary = summarize_conversation(memory)
+    if summary:
+        context_parts.append(summary)
+
+    symptom_advice = describe_symptoms(symptoms)
+    if symptom_advice:
+        context_parts.append(symptom_advice)
+
+    if wellness_advice:
+        context_parts.append(wellness_advice)
+
+    for med in meds:
+        if med not in memory["med_details"]:
+            # One label fetch serves both the details and the retrieval index
+            label = openfda_lookup(med)
+            memory["med_details"][med] = medication_details(med, label, st.session_state.profile)
+            get_index().add_label(med, label)
+        details = memory["med_details"][med]
+        if details:
+            context_parts.append(details)
+    
+    if not (symptoms or wellness_advice or meds):
+        # No medication or symptom records for this turn; ground the answer in the closest knowledge-base passages
+        retrieved = retrieve_context(user_input)
+        if retrieved:
+            context_parts.append(retrieved)
+
+    if triage.get("level") in {"self_care", "doctor_visit"}:
+        context_parts.append(f"Triage Level: {triage['level']}")
+    
+    return "\n".join(context_parts)
+
+def shed_response(reason: str, meds: list, symptoms: list) -> str:
+    """Answer from the structured data when a generation request could not be scheduled."""
+    logging.getLogger(__name__).info("generation shed: %s", reason)
+    if reason == "session_rate":
+        notice = "You're sending messages faster than I can answer them."
+    else:
+        notice = "The assistant is under heavy load right now."
+    fallback = render_lookup("overview", meds, st.session_state.profile) if meds else None
+    if fallback:
+        return f"ℹ️ {notice} Here is the key information from the medication database:\n\n{fallback}"
+    fallback = describe_symptoms(symptoms)
+    if fallback:
+        return f"ℹ️ {notice} Here is general guidance for the symptoms you mentioned:\n\n{fallback}"
+    return f"ℹ️ {notice} Please try again in a moment."
+
 def process_input(user_input: str):
     triage = infermedica_triage(user_input, st.session_state.profile)
     if triage.get("level") == "emergency" or is_emergency(user_input):
@@ -268,28 +400,35 @@ def process_input(user_input: str):
             "Do not rely on this assistant for life-threatening situations."
         )
 
-    context_parts = []
-    symptom_advice = analyze_symptoms(user_input)
-    if symptom_advice:
-        context_parts.append(symptom_advice)
+    memory = st.session_state.conversation
+    profile_key = json.dumps(st.session_state.profile, sort_keys=True)
+    if memory["profile_key"] != profile_key:
+        # Cached details embed profile-based alerts, so they are stale once the profile changes
+        memory["med_details"] = {}
+        memory["profile_key"] = profile_key
 
+    symptoms = find_symptoms(user_input)
     wellness_advice = analyze_wellness(user_input)
-    if wellness_advice:
-        context_parts.append(wellness_advice)
-
     found_meds = find_medications(user_input)
-    if found_meds:
-        for med in found_meds:
-            details = get_medication_details(med, st.session_state.profile)
-            if details:
-                context_parts.append(details)
-    
-    if triage.get("level") in {"self_care", "doctor_visit"}:
-        context_parts.append(f"Triage Level: {triage['level']}")
-    
-    context = "\n".join(context_parts)
+    meds = turn_medications(memory, user_input, found_meds, symptoms, wellness_advice)
+
+    # Pure lookups about known medications are answered from the records without the LLM
+    intent = classify_intent(user_input)
+    ai_response = None
+    if intent != "general" and meds and not (symptoms or wellness_advice) and triage.get("level") != "doctor_visit":
+        ai_response = render_lookup(intent, meds, st.session_state.profile)
+    if ai_response:
+        record_route("template", intent)
+        remember(memory, found_meds, symptoms, triage.get("level"), focus_meds=meds)
+    else:
+        record_route("llm", intent)
+        context = build_context(user_input, memory, symptoms, wellness_advice, meds, triage)
+        remember(memory, found_meds, symptoms, triage.get("level"), focus_meds=meds)
+        try:
+            ai_response = generate_ai_response(user_input, context)
+        except Overloaded as e:
+            ai_response = shed_response(e.reason, meds, symptoms)
 
-    ai_response = generate_ai_response(user_input, context)
     if found_meds and len(found_meds) > 1:
         ai_response += "\n\n💡 **Note:** You mentioned multiple medications. Check the 'Interaction Checker' tab for safety."
 
@@ -301,7 +440,33 @@ def process_input(user_input: str):
         header = "ℹ️ Risk Level: Self-care appropriate with monitoring.\n\n"
     elif lvl == "unknown":
         header = "ℹ️ Risk Level: Unable to determine; consider professional advice if concerned.\n\n"
-    return f"{header}{ai_response}\n\n---\n{DISCLAIMER}"
+    return f"{header}{ai_response}"
+
+def add_chat_message(role: str, content: str):
+    # The disclaimer is attached at render time rather than stored with every message
+    st.session_state.chat_history.append({"role": role, "content": content, "disclaimer": role == "assistant"})
+    overflow = len(st.session_state.chat_history) - MAX_CHAT_HISTORY
+    # Turns leave session memory only once the archive holds them; otherwise they stay in memory
+    if overflow > 0 and archive_messages(st.session_state.session_id, st.session_state.chat_history[:overflow]):
+        del st.session_state.chat_history[:overflow]
+
+def render_chat_message(chat: dict):
+    with st.chat_message(chat["role"]):
+        if chat.get("disclaimer"):
+            st.markdown(f"{chat['content']}\n\n---\n{DISCLAIMER}")
+        else:
+            st.markdown(chat["content"])
+
+def visible_chat_history(archived: int) -> list:
+    """Return the messages on the currently loaded pages, pulling older ones from the archive."""
+    history = st.session_state.chat_history
+    visible = st.session_state.history_visible
+    if visible <= len(history):
+        return history[-visible:]
+    return load_archived(st.session_state.session_id, min(visible - len(history), archived)) + history
+
+def session_memory_kb() -> float:
+    return sum(sys.getsizeof(m["content"]) for m in st.session_state.chat_history) / 1024
 
 def main():
     # --- Sidebar: User Profile ---
@@ -319,6 +484,11 @@ def main():
         available = available_backends()
         default_backend = available[0] if available else "Local (FLAN-T5-Base)"
         st.session_state.model_backend = st.selectbox("Model Backend", available, index=available.index(default_backend) if available else 0)
+        archived = count_archived(st.session_state.session_id)
+        st.caption(
+            f"Chat memory: {session_memory_kb():.1f} KB across {len(st.session_state.chat_history)} messages "
+            f"({archived} older messages archived)"
+        )
 
     # --- Main Interface ---
     st.title("🩺 Healthcare Assistant Pro")
@@ -336,25 +506,27 @@ def main():
     with tab_chat:
         st.subheader("Ask Dr. AI")
         
-        # Display chat history
-        for chat in st.session_state.chat_history:
-            with st.chat_message(chat["role"]):
-                st.markdown(chat["content"])
+        # Display chat history, one page at a time
+        total = archived + len(st.session_state.chat_history)
+        if total > st.session_state.history_visible:
+            if st.button("Load earlier messages"):
+                st.session_state.history_visible += HISTORY_PAGE_SIZE
+        for chat in visible_chat_history(archived):
+            render_chat_message(chat)
 
         # Input area
         if prompt := st.chat_input("Describe your symptoms or ask about a medication..."):
             # User message
-            st.session_state.chat_history.append({"role": "user", "content": prompt})
-            with st.chat_message("user"):
-                st.markdown(prompt)
+            add_chat_message("user", prompt)
+            render_chat_message(st.session_state.chat_history[-1])
 
             # Assistant message
             with st.chat_message("assistant"):
                 with st.spinner("Analyzing medical database..."):
                     response = process_input(prompt)
-                    st.markdown(response)
+                    st.markdown(f"{response}\n\n---\n{DISCLAIMER}")
             
-            st.session_state.chat_history.append({"role": "assistant", "content": response})
+            add_chat_message("assistant", response)
 
     # --- Tab 2: Medication Database ---
     with tab_db:
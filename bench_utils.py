@@ -0,0 +1,128 @@
+"""Microbenchmarks for the utils hot paths, checked against perf_budgets.json.
+
+    python bench_utils.py            # fail (exit 1) if any function exceeds its budget
+    python bench_utils.py --record   # re-record budgets from this machine, with headroom
+
+The formulary is padded with synthetic medications up to the size recorded in the
+budgets file so the numbers reflect a realistically sized database.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import statistics
+import tracemalloc
+
+# Isolated, offline environment: no profiling wrappers, no shared cache or index files
+_tmp = tempfile.mkdtemp(prefix="hca-bench-")
+os.environ.pop("HCA_PROFILE", None)
+os.environ["HCA_CACHE_PATH"] = os.path.join(_tmp, "cache.sqlite3")
+os.environ["HCA_INDEX_PATH"] = os.path.join(_tmp, "formulary.idx")
+for key in ("INFERMEDICA_APP_ID", "INFERMEDICA_APP_KEY"):
+    os.environ.pop(key, None)
+
+import data
+import utils
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_budgets.json")
+# Recorded budgets leave this much room for machine-to-machine noise
+HEADROOM = 3.0
+PROFILE = {"name": "Bench", "age": 30, "conditions": "liver, kidney"}
+
+CASES = {
+    "find_medications": lambda: utils.find_medications("I take advil and lipitor every morning"),
+    "find_medications_fuzzy": lambda: utils.find_medications("I take ibuprofin and metformn"),
+    "analyze_symptoms": lambda: utils.analyze_symptoms("I have a headache and a sore throat since yesterday"),
+    "analyze_wellness": lambda: utils.analyze_wellness("Any tips for better sleep and less stress?"),
+    "check_interaction": lambda: utils.check_interaction("ibuprofen", "aspirin"),
+    "get_medication_details": lambda: utils.get_medication_details("paracetamol", PROFILE),
+    "infermedica_triage": lambda: utils.infermedica_triage("severe headache and fever", PROFILE),
+}
+
+def grow_formulary(size: int):
+    """Pad MEDICATIONS with renamed copies of the real entries up to `size` records."""
+    real = list(data.MEDICATIONS.items())
+    i = 0
+    while len(data.MEDICATIONS) < size:
+        name, record = real[i % len(real)]
+        suffix = f"x{i}"
+        copy = dict(record)
+        copy["aliases"] = [a + suffix for a in record.get("aliases", [])]
+        data.MEDICATIONS[name + suffix] = copy
+        i += 1
+
+def measure(case, repeat: int) -> dict:
+    """Median wall time and peak traced allocation for one cold call."""
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        # Measure the uncached path; the shared token cache would otherwise hide tokenizing
+        utils.tokenize.cache_clear()
+        utils.normalize.cache_clear()
+        start = time.perf_counter()
+        case()
+        times.append(time.perf_counter() - start)
+    for _ in range(min(repeat, 20)):
+        utils.tokenize.cache_clear()
+        utils.normalize.cache_clear()
+        tracemalloc.start()
+        case()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {"time_us": statistics.median(times) * 1e6, "peak_kb": peak / 1024}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--record", action="store_true", help="write new budgets instead of checking them")
+    parser.add_argument("--size", type=int, help="formulary size (defaults to the recorded one)")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    budgets = {}
+    if os.path.exists(BUDGETS_PATH):
+        with open(BUDGETS_PATH, encoding="utf-8") as f:
+            budgets = json.load(f)
+    size = args.size or budgets.get("formulary_size", 500)
+
+    # No network during benchmarks: openFDA lookups resolve to "unavailable"
+    utils.requests = None
+    grow_formulary(size)
+    utils.get_formulary_index()  # build once so the benchmarks measure lookups only
+
+    results = {name: measure(case, args.repeat) for name, case in CASES.items()}
+
+    if args.record:
+        budgets = {
+            "formulary_size": size,
+            "functions": {
+                name: {
+                    "time_us": round(r["time_us"] * HEADROOM, 1),
+                    "peak_kb": round(r["peak_kb"] * HEADROOM, 1),
+                }
+                for name, r in results.items()
+            },
+        }
+        with open(BUDGETS_PATH, "w", encoding="utf-8") as f:
+            json.dump(budgets, f, indent=2)
+            f.write("\n")
+        print(f"Budgets recorded in {BUDGETS_PATH} (formulary size {size})")
+        return 0
+
+    failures = 0
+    print(f"formulary size: {size}")
+    for name, r in results.items():
+        budget = budgets.get("functions", {}).get(name)
+        status = "ok"
+        if budget and (r["time_us"] > budget["time_us"] or r["peak_kb"] > budget["peak_kb"]):
+            status = "OVER BUDGET"
+            failures += 1
+        elif not budget:
+            status = "no budget"
+        limits = f"{budget['time_us']:.1f} us / {budget['peak_kb']:.1f} KiB" if budget else "-"
+        print(f"{name:<24} {r['time_us']:>10.1f} us {r['peak_kb']:>9.1f} KiB   budget {limits:<26} {status}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
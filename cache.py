@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from typing import Any, Optional
+
+# A single SQLite file shared by every Streamlit replica run by the same user, so
+# lookups cached by one process are visible to all of them. It also holds archived
+# chat turns, so it lives in a private per-user directory and is readable by its owner only.
+CACHE_PATH = os.getenv(
+    "HCA_CACHE_PATH",
+    os.path.join(
+        os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+        "healthcare_assistant",
+        "cache.sqlite3"
+    )
+)
+DEFAULT_TTL = int(os.getenv("HCA_CACHE_TTL", "86400"))
+
+_local = threading.local()
+
+def _create_private(path: str):
+    """Create the database file (and its directory) accessible to the current user only."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+    # SQLite creates its -wal/-shm files with the same permissions as the database
+    os.chmod(path, 0o600)
+
+def _connect() -> Optional[sqlite3.Connection]:
+    """Return this thread's connection to the shared cache, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        return conn
+    try:
+        _create_private(CACHE_PATH)
+        conn = sqlite3.connect(CACHE_PATH, timeout=5, isolation_level=None)
+        # WAL lets readers in other processes proceed while one process writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("DELETE FROM cache WHERE expires < ?", (time.time(),))
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS chat_archive ("
+            "session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+            "disclaimer INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+        )
+        # Archived chat turns are kept no longer than cached lookups
+        conn.execute("DELETE FROM chat_archive WHERE created < ?", (time.time() - DEFAULT_TTL,))
+    except (OSError, sqlite3.Error):
+        return None
+    _local.conn = conn
+    return conn
+
+def cache_get(namespace: str, key: str) -> Optional[Any]:
+    """Fetch a cached value, or None if it is missing or expired."""
+    conn = _connect()
+    if conn is None:
+        return None
+    try:
+        row = conn.execute(
+            "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row or row[1] < time.time():
+        return None
+    return json.loads(row[0])
+
+def cache_set(namespace: str, key: str, value: Any, ttl: int = None) -> None:
+    """Store a JSON-serializable value for all processes sharing the cache file."""
+    conn = _connect()
+    if conn is None:
+        return
+    expires = time.time() + (ttl if ttl is not None else DEFAULT_TTL)
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), expires)
+        )
+    except sqlite3.Error:
+        pass
+
+def archive_messages(session_id: str, messages: list) -> bool:
+    """Spill older chat turns into the on-disk archive. Returns True once they are stored."""
+    conn = _connect()
+    if conn is None or not messages:
+        return False
+    try:
+        # One write transaction: the sequence read and every insert succeed or fail together,
+        # so a failed call leaves nothing behind to be archived twice on retry
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM chat_archive WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            start = row[0] + 1
+            now = time.time()
+            conn.executemany(
+                "INSERT INTO chat_archive (session_id, seq, role, content, disclaimer, created) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, start + i, m["role"], m["content"], int(bool(m.get("disclaimer"))), now)
+                    for i, m in enumerate(messages)
+                ]
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+    except sqlite3.Error:
+        return False
+    return True
+
+def count_archived(session_id: str) -> int:
+    conn = _connect()
+    if conn is None:
+        return 0
+    try:
+        return conn.execute(
+            "SELECT COUNT(*) FROM chat_archive WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+def load_archived(session_id: str, limit: int) -> list:
+    """Return the newest `limit` archived turns, oldest first."""
+    conn = _connect()
+    if conn is None or limit <= 0:
+        return []
+    try:
+        rows = conn.execute(
+            "SELECT role, content, disclaimer FROM chat_archive WHERE session_id = ? "
+            "ORDER BY seq DESC LIMIT ?",
+            (session_id, limit)
+        ).fetchall()
+    except sqlite3.Error:
+        return []
+    return [{"role": r, "content": c, "disclaimer": bool(d)} for r, c, d in reversed(rows)]
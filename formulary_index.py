@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+from typing import Optional
+from data import MEDICATIONS, SYMPTOMS_DB, WELLNESS_DB, EMERGENCY_KEYWORDS
+
+# Bump whenever the artifact layout or the normalization used to build it changes
+INDEX_VERSION = 4
+INDEX_PATH = os.getenv(
+    "HCA_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "formulary.idx")
+)
+
+# Header: magic, format version, sha256 of the source data (hex), followed by a UTF-8
+# JSON payload. It holds plain data only, so loading a tampered file cannot run code.
+MAGIC = b"HCAIDX"
+HEADER = struct.Struct("6sI64s")
+
+_index = None
+_lock = threading.Lock()
+
+def source_hash() -> str:
+    """Content hash of the data the index is built from."""
+    payload = json.dumps(
+        [INDEX_VERSION, MEDICATIONS, SYMPTOMS_DB, WELLNESS_DB, EMERGENCY_KEYWORDS],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def build_index() -> dict:
+    """Compile every lookup structure derived from data.py."""
+    # Imported here because utils loads this module at import time
+    from utils import normalize
+
+    terms = {}
+    for name, data in MEDICATIONS.items():
+        terms[normalize(name)] = name
+        for alias in data.get("aliases", []):
+            terms[normalize(alias)] = name
+
+    # One alternation for all names/aliases; longest first so multi-word aliases win
+    ordered = sorted(terms, key=len, reverse=True)
+    matcher = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in ordered) + r")\b")
+
+    # Fuzzy candidates bucketed by length: difflib's ratio can only reach the 0.8 cutoff
+    # when the lengths are close, so lookups skip every other bucket.
+    fuzzy = {}
+    for term in terms:
+        fuzzy.setdefault(len(term), []).append(term)
+
+    interactions = {
+        name: frozenset(normalize(i) for i in data.get("interactions", []))
+        for name, data in MEDICATIONS.items()
+    }
+
+    return {
+        "records": MEDICATIONS,
+        "terms": terms,
+        "matcher": matcher,
+        "fuzzy": fuzzy,
+        "interactions": interactions,
+        "symptom_keys": list(SYMPTOMS_DB.keys()),
+    }
+
+def encode_index(index: dict) -> bytes:
+    """JSON form of the index: the matcher as its pattern, sets as sorted lists."""
+    payload = dict(index)
+    payload["matcher"] = index["matcher"].pattern
+    payload["interactions"] = {name: sorted(terms) for name, terms in index["interactions"].items()}
+    return json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+def decode_index(raw: bytes) -> dict:
+    """Inverse of encode_index."""
+    index = json.loads(raw.decode("utf-8"))
+    index["matcher"] = re.compile(index["matcher"])
+    # JSON object keys are always strings
+    index["fuzzy"] = {int(length): terms for length, terms in index["fuzzy"].items()}
+    index["interactions"] = {name: frozenset(terms) for name, terms in index["interactions"].items()}
+    return index
+
+def save_index(index: dict, digest: str, path: str = INDEX_PATH):
+    """Write the artifact atomically so concurrent readers never see a partial file.
+
+    Persisting is best effort: if the directory is missing or read-only the index
+    simply stays in memory for this process.
+    """
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".formulary-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, INDEX_VERSION, digest.encode("ascii")))
+            f.write(encode_index(index))
+        # mkstemp creates 0600 files; an index built as root at image build time
+        # must stay readable by the (possibly non-root) runtime user
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except OSError:
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+def read_index(digest: str, path: str = INDEX_PATH) -> Optional[dict]:
+    """Load the artifact, or None if it is missing, corrupt or stale."""
+    try:
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return None
+            magic, version, stored = HEADER.unpack(header)
+            if magic != MAGIC or version != INDEX_VERSION or stored.decode("ascii") != digest:
+                return None
+            return decode_index(f.read())
+    except (OSError, ValueError, KeyError, TypeError, AttributeError, re.error):
+        return None
+
+def get_index() -> dict:
+    """Process-wide formulary index, loaded on first use and rebuilt if the data changed."""
+    global _index
+    with _lock:
+        if _index is None:
+            digest = source_hash()
+            _index = read_index(digest)
+            if _index is None:
+                _index = build_index()
+                save_index(_index, digest)
+        return _index
+
+if __name__ == "__main__":
+    save_index(build_index(), source_hash())
+    print(f"Formulary index written to {INDEX_PATH}")
@@ -0,0 +1,90 @@
+import os
+import time
+import pstats
+import cProfile
+import functools
+import itertools
+import threading
+import tracemalloc
+
+# Opt-in: HCA_PROFILE=1 wraps the utils hot paths; when unset the decorator is a no-op
+ENABLED = os.getenv("HCA_PROFILE", "").lower() in {"1", "true", "yes"}
+PROFILE_DIR = os.getenv("HCA_PROFILE_DIR", "profiles")
+# Allocation sites listed per request
+ALLOC_TOP = 15
+
+_local = threading.local()
+# cProfile allows one active profiler per process on newer Pythons, so profiled calls run one at a time
+_lock = threading.Lock()
+_counter = itertools.count()
+
+def _label(func_key) -> str:
+    filename, lineno, name = func_key
+    return f"{os.path.basename(filename)}:{name}:{lineno}"
+
+def folded_stacks(stats: pstats.Stats) -> list:
+    """Collapsed stacks ("a;b;c <microseconds>") for flamegraph.pl / speedscope.
+
+    cProfile records caller/callee edges rather than full stacks, so each function's
+    own time is spread over its call paths in proportion to the time spent on each edge.
+    """
+    entries = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    lines = {}
+    def walk(func, path, fraction):
+        _, _, own, total, _ = entries[func]
+        path = path + [func]
+        micros = int(own * fraction * 1e6)
+        if micros:
+            key = ";".join(_label(f) for f in path)
+            lines[key] = lines.get(key, 0) + micros
+        for callee, edge_time in callees.get(func, []):
+            callee_total = entries[callee][3]
+            if callee in path or not callee_total:
+                continue
+            walk(callee, path, fraction * edge_time / callee_total)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, [], 1.0)
+    return [f"{stack} {micros}" for stack, micros in sorted(lines.items())]
+
+def _dump(name: str, profile: cProfile.Profile, before, after):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{name}-{int(time.time() * 1000)}-{next(_counter)}")
+    profile.dump_stats(base + ".prof")
+    stats = pstats.Stats(profile)
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.write("\n".join(folded_stacks(stats)) + "\n")
+    with open(base + ".alloc.txt", "w", encoding="utf-8") as f:
+        for stat in after.compare_to(before, "lineno")[:ALLOC_TOP]:
+            f.write(f"{stat}\n")
+
+def profiled(func):
+    """Write a cProfile dump, folded stacks and an allocation top-list for every call."""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Only the outermost profiled call in a thread is recorded
+        if getattr(_local, "active", False):
+            return func(*args, **kwargs)
+        with _lock:
+            _local.active = True
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(func, *args, **kwargs)
+            finally:
+                after = tracemalloc.take_snapshot()
+                _local.active = False
+                _dump(func.__name__, profile, before, after)
+
+    return wrapper
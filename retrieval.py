@@ -0,0 +1,190 @@
+import math
+import heapq
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from data import MEDICATIONS, SYMPTOMS_DB, WELLNESS_DB
+from utils import tokenize as text_tokens
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "'s", "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "does", "don't", "for", "from",
+    "how", "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "should", "so", "that", "the",
+    "this", "to", "what", "when", "which", "with", "you", "your"
+}
+# Field labels present in every passage of a kind; they would make generic questions
+# ("and contraindications?") match every drug equally, so they are not index terms
+FIELD_WORDS = {
+    "use", "uses", "warning", "warnings", "contraindication", "contraindications", "side", "effect",
+    "effects", "possible", "cause", "causes", "home", "care", "red", "flag", "flags", "label",
+}
+# Hits must clear this BM25 score, come within this fraction of the best hit, and match
+# this share of the query terms the index knows about
+MIN_SCORE = 1.0
+MIN_RELATIVE_SCORE = 0.5
+MIN_COVERAGE = 0.5
+# A negation drops the next few query terms ("...that don't upset the stomach")
+NEGATIONS = {"don't", "not", "no", "without", "never", "avoid", "doesn't", "won't"}
+NEGATION_SPAN = 2
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms, dropping stopwords and naive plural endings."""
+    terms = []
+    for word in text_tokens(text):
+        if word in STOPWORDS or word in FIELD_WORDS:
+            continue
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def query_terms(text: str) -> List[str]:
+    """Index terms for a query, leaving out the ones the user asks to avoid."""
+    terms = []
+    skip = 0
+    for word in text_tokens(text):
+        if word in NEGATIONS:
+            skip = NEGATION_SPAN
+            continue
+        term = tokenize(word)
+        if not term:
+            continue
+        if skip:
+            skip -= 1
+            continue
+        terms.extend(term)
+    return terms
+
+def source_chunks() -> Dict[str, str]:
+    """One passage per medication, symptom and wellness topic in the knowledge base."""
+    chunks = {}
+    for name, data in MEDICATIONS.items():
+        # Dosage fields are deliberately left out, matching get_medication_details
+        chunks[f"med:{name}"] = (
+            f"{name.capitalize()} ({', '.join(data.get('aliases', []))}) - {data.get('category', 'Unknown')}. "
+            f"Uses: {data['uses']} Warnings: {data['warnings']} "
+            f"Contraindications: {data.get('contraindications', 'None listed')} "
+            f"Side effects: {data['side_effects']}"
+        )
+    for symptom, data in SYMPTOMS_DB.items():
+        chunks[f"symptom:{symptom}"] = (
+            f"{symptom.capitalize()}. Possible causes: {', '.join(data['possible_causes'])}. "
+            f"Home care: {data['recommendations']} Red flags: {data['red_flags']}"
+        )
+    for topic, advice in WELLNESS_DB.items():
+        chunks[f"wellness:{topic}"] = f"{topic.capitalize()}: {advice}"
+    return chunks
+
+def _fingerprint(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class RetrievalIndex:
+    """In-memory BM25 index over knowledge-base passages, updated chunk by chunk."""
+
+    def __init__(self):
+        self.texts: Dict[str, str] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self.lengths: Dict[str, int] = {}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def _add(self, chunk_id: str, text: str):
+        terms = Counter(tokenize(text))
+        self.texts[chunk_id] = text
+        self.fingerprints[chunk_id] = _fingerprint(text)
+        self.lengths[chunk_id] = sum(terms.values())
+        self.total_length += self.lengths[chunk_id]
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def _remove(self, chunk_id: str):
+        for term in set(tokenize(self.texts[chunk_id])):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(chunk_id, None)
+                if not docs:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id)
+        del self.texts[chunk_id]
+        del self.fingerprints[chunk_id]
+
+    def upsert(self, chunk_id: str, text: str) -> bool:
+        """Index a passage, re-indexing only if its content changed. Returns True if it did."""
+        with self.lock:
+            if self.fingerprints.get(chunk_id) == _fingerprint(text):
+                return False
+            if chunk_id in self.texts:
+                self._remove(chunk_id)
+            self._add(chunk_id, text)
+            return True
+
+    def refresh(self) -> int:
+        """Sync with the knowledge base, touching only added, changed or deleted passages."""
+        chunks = source_chunks()
+        changed = sum(self.upsert(chunk_id, text) for chunk_id, text in chunks.items())
+        with self.lock:
+            # Imported label text is not part of the knowledge base and survives a refresh
+            stale = [c for c in self.texts if c not in chunks and not c.startswith("label:")]
+            for chunk_id in stale:
+                self._remove(chunk_id)
+        return changed + len(stale)
+
+    def add_label(self, name: str, label: Optional[Dict[str, str]]):
+        """Index imported drug label text (e.g. an openFDA lookup result)."""
+        if not label:
+            return
+        text = " ".join(v for v in label.values() if v)
+        if text:
+            self.upsert(f"label:{name}", f"{name.capitalize()} label: {text}")
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, str, float]]:
+        """Return up to k relevant (chunk_id, text, score) passages for the query, best first."""
+        with self.lock:
+            n = len(self.texts)
+            # Terms the index has never seen can't be matched by any passage
+            terms = {t for t in query_terms(query) if t in self.postings}
+            if not n or not terms:
+                return []
+            avg_length = self.total_length / n
+            scores: Dict[str, float] = {}
+            matched: Dict[str, int] = {}
+            for term in terms:
+                docs = self.postings[term]
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for chunk_id, tf in docs.items():
+                    norm = K1 * (1 - B + B * self.lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+                    matched[chunk_id] = matched.get(chunk_id, 0) + 1
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            if not best:
+                return []
+            cutoff = max(MIN_SCORE, best[0][1] * MIN_RELATIVE_SCORE)
+            return [
+                (chunk_id, self.texts[chunk_id], score)
+                for chunk_id, score in best
+                if score >= cutoff and matched[chunk_id] / len(terms) >= MIN_COVERAGE
+            ]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> RetrievalIndex:
+    """Process-wide index, built on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = RetrievalIndex()
+            _index.refresh()
+        return _index
+
+def retrieve_context(query: str, k: int = 3) -> str:
+    """Top-k passages formatted as generation context, or an empty string."""
+    hits = get_index().search(query, k)
+    if not hits:
+        return ""
+    return "Related reference information:\n" + "\n".join(f"- {text}" for _, text, _ in hits)
@@ -0,0 +1,211 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+class Overloaded(Exception):
+    """Raised when a generation request is not admitted; `reason` says why."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+class Ticket:
+    __slots__ = ("session_id", "backend", "granted")
+
+    def __init__(self, session_id: str, backend: str):
+        self.session_id = session_id
+        self.backend = backend
+        self.granted = False
+
+class GenerationScheduler:
+    """Admission control for generation requests.
+
+    Each session and each backend has a token bucket. Admitted requests wait in a
+    bounded queue and are dispatched round-robin across sessions, so one busy user
+    cannot starve the others, while each backend runs at most its concurrency limit.
+    """
+
+    # Idle session buckets are dropped once this many are tracked
+    MAX_TRACKED_SESSIONS = 1024
+
+    def __init__(
+        self,
+        concurrency: Dict[str, int],
+        default_concurrency: int = 4,
+        max_queue: int = 16,
+        session_rpm: float = 12,
+        session_burst: int = 4,
+        backend_rpm: float = 60,
+        backend_burst: int = 10,
+        timeout: float = 60,
+    ):
+        self.concurrency = concurrency
+        self.default_concurrency = default_concurrency
+        self.max_queue = max_queue
+        self.session_rpm = session_rpm
+        self.session_burst = session_burst
+        self.backend_rpm = backend_rpm
+        self.backend_burst = backend_burst
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.active: Dict[str, int] = {}
+        self.queues: Dict[str, deque] = {}
+        # Sessions with waiting tickets, in the order they will next be served
+        self.rotation: List[str] = []
+        self.waiting = 0
+        self.session_buckets: Dict[str, TokenBucket] = {}
+        self.backend_buckets: Dict[str, TokenBucket] = {}
+
+    def _capacity(self, backend: str) -> int:
+        return self.concurrency.get(backend, self.default_concurrency)
+
+    def _admit(self, session_id: str, backends: List[str]) -> str:
+        """Charge the rate limits and pick the first backend with budget left."""
+        if len(self.session_buckets) > self.MAX_TRACKED_SESSIONS:
+            for sid in [s for s, b in self.session_buckets.items() if b.is_full()]:
+                del self.session_buckets[sid]
+        bucket = self.session_buckets.setdefault(
+            session_id, TokenBucket(self.session_rpm / 60, self.session_burst)
+        )
+        if not bucket.try_take():
+            raise Overloaded("session_rate")
+        for backend in backends:
+            bucket = self.backend_buckets.setdefault(
+                backend, TokenBucket(self.backend_rpm / 60, self.backend_burst)
+            )
+            if bucket.try_take():
+                return backend
+        raise Overloaded("backend_rate")
+
+    def _dispatch(self):
+        """Grant free backend capacity to waiting tickets, one session at a time."""
+        granted = False
+        progressed = True
+        while progressed:
+            progressed = False
+            for sid in list(self.rotation):
+                queue = self.queues[sid]
+                ticket = queue[0]
+                if self.active.get(ticket.backend, 0) >= self._capacity(ticket.backend):
+                    continue
+                queue.popleft()
+                self.waiting -= 1
+                # The served session goes to the back of the rotation
+                self.rotation.remove(sid)
+                if queue:
+                    self.rotation.append(sid)
+                else:
+                    del self.queues[sid]
+                ticket.granted = True
+                self.active[ticket.backend] = self.active.get(ticket.backend, 0) + 1
+                granted = progressed = True
+                break
+        if granted:
+            self.cond.notify_all()
+
+    def _position(self, ticket: Ticket) -> int:
+        """1-based place of the ticket in the projected round-robin order."""
+        queues = {sid: list(q) for sid, q in self.queues.items()}
+        rotation = list(self.rotation)
+        position = 0
+        while rotation:
+            sid = rotation.pop(0)
+            position += 1
+            if queues[sid].pop(0) is ticket:
+                return position
+            if queues[sid]:
+                rotation.append(sid)
+        return position
+
+    def _withdraw(self, ticket: Ticket):
+        queue = self.queues.get(ticket.session_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self.waiting -= 1
+            if not queue:
+                del self.queues[ticket.session_id]
+                self.rotation.remove(ticket.session_id)
+
+    @contextmanager
+    def slot(self, session_id: str, backends: List[str], on_wait: Optional[Callable[[int], None]] = None):
+        """Wait for a generation slot on the first admissible backend and yield its name.
+
+        `backends` is ordered by preference; later entries are cheaper fallbacks used when
+        the preferred backend is out of budget. `on_wait` receives the queue position
+        whenever it changes. Raises Overloaded when the request has to be shed.
+        """
+        with self.cond:
+            # Checked before charging the rate limits so a shed request costs no budget
+            if self.waiting >= self.max_queue:
+                raise Overloaded("queue_full")
+            backend = self._admit(session_id, backends)
+            ticket = Ticket(session_id, backend)
+            if session_id not in self.queues:
+                self.queues[session_id] = deque()
+                self.rotation.append(session_id)
+            self.queues[session_id].append(ticket)
+            self.waiting += 1
+            self._dispatch()
+
+        deadline = time.monotonic() + self.timeout
+        last_position = None
+        try:
+            while True:
+                with self.cond:
+                    if ticket.granted:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Overloaded("timeout")
+                    position = self._position(ticket)
+                    if position == last_position:
+                        self.cond.wait(min(remaining, 1.0))
+                        continue
+                # Report outside the lock so slow UI updates never hold up dispatching
+                last_position = position
+                if on_wait:
+                    on_wait(position)
+        except BaseException:
+            # Timeouts and interruptions (e.g. Streamlit stopping the script from inside
+            # on_wait) must not leave a ticket behind that later holds a slot forever
+            with self.cond:
+                if ticket.granted:
+                    self.active[backend] -= 1
+                else:
+                    self._withdraw(ticket)
+                self._dispatch()
+            raise
+
+        try:
+            yield backend
+        finally:
+            with self.cond:
+                self.active[backend] -= 1
+                self._dispatch()
@@ -0,0 +1,23 @@
+import importlib
+import pytest
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("HCA_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    import cache
+    return importlib.reload(cache)
+
+def test_archive_round_trip(cache):
+    assert cache.archive_messages("s", [{"role": "user", "content": "a"}])
+    assert cache.archive_messages("s", [{"role": "assistant", "content": "b", "disclaimer": True}])
+    assert cache.count_archived("s") == 2
+    assert cache.load_archived("s", 1) == [{"role": "assistant", "content": "b", "disclaimer": True}]
+
+def test_failed_archive_stores_nothing(cache):
+    cache.archive_messages("s", [{"role": "user", "content": "a"}])
+    # The second row is invalid (NOT NULL content), so the whole batch must roll back
+    batch = [{"role": "user", "content": "b"}, {"role": "user", "content": None}]
+    assert not cache.archive_messages("s", batch)
+    assert cache.count_archived("s") == 1
+    assert cache.archive_messages("s", [{"role": "user", "content": "c"}])
+    assert [m["content"] for m in cache.load_archived("s", 10)] == ["a", "c"]
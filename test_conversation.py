@@ -0,0 +1,36 @@
+from utils import (
+    analyze_wellness,
+    find_medications,
+    find_symptoms,
+    new_conversation_memory,
+    remember,
+    turn_medications,
+)
+
+def run_turn(memory, text):
+    """Mirror process_input's entity handling for one chat turn."""
+    found_meds = find_medications(text)
+    symptoms = find_symptoms(text)
+    meds = turn_medications(memory, text, found_meds, symptoms, analyze_wellness(text))
+    remember(memory, found_meds, symptoms, "unknown", focus_meds=meds)
+    return meds
+
+def test_chain_of_follow_ups_keeps_the_drug():
+    memory = new_conversation_memory()
+    assert run_turn(memory, "side effects of metformin") == ["metformin"]
+    assert run_turn(memory, "what about warnings?") == ["metformin"]
+    assert run_turn(memory, "and contraindications?") == ["metformin"]
+    assert run_turn(memory, "any interactions?") == ["metformin"]
+
+def test_new_subject_ends_the_follow_up_chain():
+    memory = new_conversation_memory()
+    run_turn(memory, "side effects of metformin")
+    assert run_turn(memory, "what are the side effects of the covid vaccine?") == []
+    assert run_turn(memory, "and warnings?") == []
+    assert memory["meds"] == ["metformin"]
+
+def test_symptom_turn_does_not_carry_the_drug():
+    memory = new_conversation_memory()
+    run_turn(memory, "what is metformin used for")
+    assert run_turn(memory, "I have a headache") == []
+    assert memory["symptoms"] == ["headache"]
@@ -0,0 +1,21 @@
+from formulary_index import build_index, read_index, save_index, source_hash
+
+def test_saved_index_round_trips(tmp_path):
+    path = str(tmp_path / "formulary.idx")
+    index = build_index()
+    save_index(index, source_hash(), path)
+    loaded = read_index(source_hash(), path)
+    assert loaded["matcher"].pattern == index["matcher"].pattern
+    assert loaded["interactions"] == index["interactions"]
+    assert loaded["fuzzy"] == index["fuzzy"]
+    assert loaded["terms"] == index["terms"]
+    assert loaded["records"] == index["records"]
+
+def test_stale_or_corrupt_index_is_ignored(tmp_path):
+    path = str(tmp_path / "formulary.idx")
+    save_index(build_index(), source_hash(), path)
+    assert read_index("0" * 64, path) is None
+    with open(path, "r+b") as f:
+        f.seek(-10, 2)
+        f.write(b"\xff" * 10)
+    assert read_index(source_hash(), path) is None
@@ -0,0 +1,40 @@
+from utils import classify_intent, mentions_other_subject
+
+def test_follow_up_without_new_subject():
+    assert not mentions_other_subject("what about side effects?")
+    assert not mentions_other_subject("Who should not take it?")
+    assert not mentions_other_subject("and its warnings?")
+
+def test_question_about_another_subject():
+    assert mentions_other_subject("what are the side effects of the covid vaccine?")
+    assert mentions_other_subject("is it safe for kids")
+
+def test_lookup_intents():
+    assert classify_intent("side effects of metformin") == "side_effects"
+    assert classify_intent("What is paracetamol for?") == "uses"
+    assert classify_intent("what's tylenol") == "uses"
+    assert classify_intent("what is ibuprofen used for") == "uses"
+    assert classify_intent("does aspirin interact with ibuprofen") == "interactions"
+    assert classify_intent("who should not take lisinopril") == "contraindications"
+
+def test_open_questions_are_general():
+    assert classify_intent("what is the maximum dose of ibuprofen") == "general"
+    assert classify_intent("does ibuprofen treat my fever") == "general"
+    assert classify_intent("what does it mean if my fever comes back") == "general"
+    assert classify_intent("should I take ibuprofen with food") == "general"
+    assert classify_intent("can I take side effects seriously") == "general"
+    assert classify_intent("tell me about advil") == "general"
+
+def test_qualified_lookups_are_general():
+    assert classify_intent("What are the side effects of ibuprofen during pregnancy") == "general"
+    assert classify_intent("side effects of ibuprofen in children") == "general"
+    assert classify_intent("side effects of ibuprofen when breastfeeding") == "general"
+    assert classify_intent("does ibuprofen interact with alcohol") == "general"
+    assert classify_intent("does aspirin interact with warfarin") == "general"
+    assert classify_intent("what is the usual dose of ibuprofen, and its side effects") == "general"
+    assert classify_intent("and warnings for the elderly?") == "general"
+
+def test_lookups_naming_several_drugs_stay_templated():
+    assert classify_intent("interactions between ibuprofen and aspirin") == "interactions"
+    assert classify_intent("what are the side effects of advil and tylenol?") == "side_effects"
+    assert classify_intent("and its warnings?") == "warnings"
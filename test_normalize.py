@@ -0,0 +1,27 @@
+from utils import find_medications, normalize, tokenize
+
+def test_compatibility_forms_and_case_are_folded():
+    assert normalize("ＩＢＵＰＲＯＦＥＮ") == "ibuprofen"
+    assert normalize("STRASSE Straße") == "strasse strasse"
+
+def test_latin_accents_are_stripped():
+    assert normalize("Paracétamol") == "paracetamol"
+
+def test_punctuation_separates_tokens():
+    assert tokenize("aspirin,ibuprofen; (tylenol)!") == ("aspirin", "ibuprofen", "tylenol")
+
+def test_in_word_apostrophes_are_kept():
+    assert tokenize("don't") == ("don't",)
+    assert tokenize("I don’t know") == ("i", "don't", "know")
+
+def test_possessive_is_split_off():
+    assert tokenize("ibuprofen's side effects") == ("ibuprofen", "'s", "side", "effects")
+    assert tokenize("What’s metformin") == ("what", "'s", "metformin")
+    assert find_medications("ibuprofen's side effects") == ["ibuprofen"]
+
+def test_other_scripts_keep_their_combining_marks():
+    assert tokenize("सिरदर्द है") == ("सिरदर्द", "है")
+
+def test_normalized_text_tokenizes_the_same():
+    text = normalize("What’s in Ibuprofen's label?")
+    assert normalize(text) == text
@@ -0,0 +1,33 @@
+import pytest
+
+from retrieval import RetrievalIndex, tokenize
+
+@pytest.fixture(scope="module")
+def index():
+    index = RetrievalIndex()
+    index.refresh()
+    return index
+
+def hit_ids(index, query):
+    return [chunk_id for chunk_id, _, _ in index.search(query)]
+
+def test_field_labels_are_not_index_terms(index):
+    # Every drug passage has these labels; on their own they identify nothing
+    assert hit_ids(index, "and contraindications?") == []
+    assert hit_ids(index, "what about the side effects?") == []
+
+def test_questions_without_known_terms_retrieve_nothing(index):
+    assert hit_ids(index, "why does it cause that?") == []
+
+def test_specific_terms_retrieve_their_passage(index):
+    assert hit_ids(index, "drowsiness") == ["med:cetirizine"]
+    assert hit_ids(index, "something for hay fever") == ["med:cetirizine"]
+    assert hit_ids(index, "tips to sleep better") == ["wellness:sleep"]
+
+def test_negated_terms_do_not_steer_the_ranking(index):
+    hits = hit_ids(index, "pills for my migraine that don't upset the stomach")
+    assert "symptom:headache" in hits
+    assert "med:metformin" not in hits
+
+def test_possessive_is_not_an_index_term():
+    assert tokenize("Ibuprofen's warnings") == ["ibuprofen"]
@@ -0,0 +1,111 @@
+import time
+import threading
+import pytest
+from scheduler import GenerationScheduler, Overloaded
+
+def make_scheduler(**kwargs):
+    options = dict(session_rpm=6000, session_burst=100, backend_rpm=6000, backend_burst=100, timeout=2)
+    options.update(kwargs)
+    return GenerationScheduler({"local": 1}, **options)
+
+def hold_slot(scheduler, session_id, release):
+    """Occupy the single local slot from another thread until `release` is set."""
+    acquired = threading.Event()
+    def run():
+        with scheduler.slot(session_id, ["local"]):
+            acquired.set()
+            release.wait(5)
+    thread = threading.Thread(target=run)
+    thread.start()
+    acquired.wait(5)
+    return thread
+
+def test_round_robin_across_sessions():
+    scheduler = make_scheduler()
+    release = threading.Event()
+    holder = hold_slot(scheduler, "holder", release)
+    order = []
+    def run(session_id):
+        with scheduler.slot(session_id, ["local"]):
+            order.append(session_id)
+    threads = []
+    for session_id in ["A", "A", "A", "B", "B"]:
+        thread = threading.Thread(target=run, args=(session_id,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.05)
+    release.set()
+    for thread in [holder] + threads:
+        thread.join(5)
+    assert order == ["A", "B", "A", "B", "A"]
+
+def test_interrupted_wait_releases_its_ticket():
+    scheduler = make_scheduler()
+    release = threading.Event()
+    holder = hold_slot(scheduler, "holder", release)
+
+    def stop(position):
+        raise KeyboardInterrupt("script stopped")
+    with pytest.raises(KeyboardInterrupt):
+        with scheduler.slot("user", ["local"], on_wait=stop):
+            pass
+
+    release.set()
+    holder.join(5)
+    assert scheduler.active["local"] == 0
+    assert scheduler.waiting == 0 and not scheduler.queues
+    with scheduler.slot("user", ["local"]) as backend:
+        assert backend == "local"
+
+def test_timeout_withdraws_ticket():
+    scheduler = make_scheduler(timeout=0.1)
+    release = threading.Event()
+    holder = hold_slot(scheduler, "holder", release)
+    with pytest.raises(Overloaded) as excinfo:
+        with scheduler.slot("user", ["local"]):
+            pass
+    assert excinfo.value.reason == "timeout"
+    release.set()
+    holder.join(5)
+    assert scheduler.active["local"] == 0 and scheduler.waiting == 0
+
+def test_session_rate_limit():
+    scheduler = make_scheduler(session_rpm=60, session_burst=1)
+    with scheduler.slot("user", ["local"]):
+        pass
+    with pytest.raises(Overloaded) as excinfo:
+        with scheduler.slot("user", ["local"]):
+            pass
+    assert excinfo.value.reason == "session_rate"
+
+def test_falls_back_to_cheaper_backend():
+    scheduler = GenerationScheduler({}, backend_rpm=60, backend_burst=1)
+    with scheduler.slot("a", ["cloud", "local"]) as backend:
+        assert backend == "cloud"
+    with scheduler.slot("b", ["cloud", "local"]) as backend:
+        assert backend == "local"
+
+def test_full_queue_sheds_without_spending_budget():
+    scheduler = make_scheduler(max_queue=1, session_rpm=60, session_burst=1, timeout=5)
+    release = threading.Event()
+    holder = hold_slot(scheduler, "holder", release)
+    def wait_for_slot():
+        with scheduler.slot("other", ["local"]):
+            pass
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    while not scheduler.waiting:
+        time.sleep(0.01)
+
+    with pytest.raises(Overloaded) as excinfo:
+        with scheduler.slot("user", ["local"]):
+            pass
+    assert excinfo.value.reason == "queue_full"
+    assert "user" not in scheduler.session_buckets
+    backend_tokens = scheduler.backend_buckets["local"].tokens
+
+    release.set()
+    holder.join(5)
+    waiter.join(5)
+    assert scheduler.backend_buckets["local"].tokens >= backend_tokens
+    assert scheduler.active["local"] == 0
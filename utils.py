@@ -1,23 +1,67 @@
-import re
 import difflib
 import os
 import json
+import logging
+import threading
+import unicodedata
+from collections import Counter
+from functools import lru_cache
 from typing import Optional, Dict
 try:
     import requests
 except Exception:
     requests = None
-from data import MEDICATIONS, SYMPTOMS_DB, WELLNESS_DB, EMERGENCY_KEYWORDS, DISCLAIMER
+from data import SYMPTOMS_DB, WELLNESS_DB, EMERGENCY_KEYWORDS, DISCLAIMER
+from cache import cache_get, cache_set
+from formulary_index import get_index as get_formulary_index
+from profiling import profiled
 
+logger = logging.getLogger(__name__)
+
+def is_token_char(c: str) -> bool:
+    """Letters, digits and combining marks (needed by scripts such as Devanagari) form tokens."""
+    return unicodedata.category(c)[0] in "LNM"
+
+def strip_accents(text: str) -> str:
+    """Drop diacritics from Latin letters, leaving combining marks of other scripts intact."""
+    out = []
+    for c in unicodedata.normalize("NFD", text):
+        if unicodedata.combining(c) and out and ord(out[-1]) < 0x250:
+            continue
+        out.append(c)
+    return unicodedata.normalize("NFC", "".join(out))
+
+@lru_cache(maxsize=4096)
+def tokenize(text: str) -> tuple:
+    """Token stream shared by all analyzers: NFKC, casefold, accent stripping, punctuation split."""
+    text = strip_accents(unicodedata.normalize("NFKC", text).casefold().replace("\u2019", "'"))
+    chars = []
+    for i, c in enumerate(text):
+        # Apostrophes only survive inside a word ("don't"); all other punctuation separates tokens
+        inner_apostrophe = c == "'" and 0 < i < len(text) - 1 and is_token_char(text[i - 1]) and is_token_char(text[i + 1])
+        # A split-off 's stays intact, so tokenizing normalized text gives the same tokens
+        lone_s = c == "'" and text[i + 1:i + 2] == "s" and not is_token_char(text[i + 2:i + 3] or " ")
+        chars.append(c if is_token_char(c) or inner_apostrophe or lone_s else " ")
+    tokens = []
+    for word in "".join(chars).split():
+        # The possessive/contracted 's is its own token, so "ibuprofen's" still names ibuprofen
+        if word.endswith("'s") and len(word) > 2:
+            tokens.extend((word[:-2], "'s"))
+        else:
+            tokens.append(word)
+    return tuple(tokens)
+
+@lru_cache(maxsize=4096)
 def normalize(text: str) -> str:
     """Normalize text for consistent searching."""
-    return re.sub(r"\s+", " ", text.strip()).lower()
+    return " ".join(tokenize(text))
 
 def is_emergency(text: str) -> bool:
     """Check if the text contains emergency keywords."""
     text = normalize(text)
     return any(k in text for k in EMERGENCY_KEYWORDS)
 
+@profiled
 def analyze_wellness(text: str) -> str:
     """Check for general wellness topics."""
     text = normalize(text)
@@ -36,42 +80,38 @@ def analyze_wellness(text: str) -> str:
         
     return response
 
+def fuzzy_candidates(word: str, buckets: dict) -> list:
+    """Terms long enough/short enough to reach a 0.8 difflib ratio against `word`."""
+    n = len(word)
+    candidates = []
+    for length in range(-(-2 * n // 3), 3 * n // 2 + 1):
+        candidates.extend(buckets.get(length, ()))
+    return candidates
+
+@profiled
 def find_medications(text: str):
     """Find known medications (or close matches/aliases) in the text."""
     text = normalize(text)
     words = text.split()
-    found = set()
+    index = get_formulary_index()
+    terms = index["terms"]
     
-    # 1. Exact matches for keys and aliases
-    for name, data in MEDICATIONS.items():
-        # Check main name
-        if re.search(r'\b' + re.escape(name) + r'\b', text):
-            found.add(name)
-        
-        # Check aliases
-        for alias in data.get("aliases", []):
-            if re.search(r'\b' + re.escape(alias) + r'\b', text):
-                found.add(name) # Map alias back to canonical name
+    # 1. Exact matches for keys and aliases (aliases map back to the canonical name)
+    found = {terms[m.group(0)] for m in index["matcher"].finditer(text)}
 
     # 2. Fuzzy matching for typos if no exact match found
     if not found:
-        # Collect all valid names + aliases
-        all_terms = {}
-        for name, data in MEDICATIONS.items():
-            all_terms[name] = name
-            for alias in data.get("aliases", []):
-                all_terms[alias] = name
-        
         # Check each word in user input against dictionary
         for word in words:
             if len(word) > 3: # Skip short words
-                matches = difflib.get_close_matches(word, all_terms.keys(), n=1, cutoff=0.8)
+                matches = difflib.get_close_matches(word, fuzzy_candidates(word, index["fuzzy"]), n=1, cutoff=0.8)
                 if matches:
-                    canonical_name = all_terms[matches[0]]
+                    canonical_name = terms[matches[0]]
                     found.add(canonical_name)
 
     return list(found)
 
+@profiled
 def check_interaction(med_a: str, med_b: str) -> str:
     """Check interactions between two medications."""
     med_a = normalize(med_a)
@@ -82,8 +122,10 @@ def check_interaction(med_a: str, med_b: str) -> str:
     # but if manually typed, we might need to resolve.
     # For now, we assume dropdown inputs are canonical keys.
     
-    a_data = MEDICATIONS.get(med_a)
-    b_data = MEDICATIONS.get(med_b)
+    index = get_formulary_index()
+    a_data = index["records"].get(med_a)
+    b_data = index["records"].get(med_b)
+    interactions = index["interactions"]
 
     if not a_data or not b_data:
         return (
@@ -95,11 +137,11 @@ def check_interaction(med_a: str, med_b: str) -> str:
     interaction_found = False
     details = []
 
-    if med_b in a_data.get("interactions", []):
+    if med_b in interactions[med_a]:
         interaction_found = True
         details.append(f"{med_a.capitalize()} is known to interact with {med_b}.")
     
-    if med_a in b_data.get("interactions", []):
+    if med_a in interactions[med_b]:
         interaction_found = True
         # Avoid duplicate message if already added
         msg = f"{med_b.capitalize()} is known to interact with {med_a}."
@@ -124,48 +166,62 @@ def check_interaction(med_a: str, med_b: str) -> str:
             f"However, always confirm with a professional.\n\n{DISCLAIMER}"
         )
 
-def analyze_symptoms(text: str) -> str:
-    """Analyze text for symptoms and provide advice."""
+def find_symptoms(text: str) -> list:
+    """Find known symptoms (or close matches) in the text."""
     text = normalize(text)
-    detected_symptoms = []
-    
-    for symptom, data in SYMPTOMS_DB.items():
-        if symptom in text:
-            detected_symptoms.append((symptom, data))
-            
-    if not detected_symptoms:
+    symptom_keys = get_formulary_index()["symptom_keys"]
+    found = [symptom for symptom in symptom_keys if symptom in text]
+
+    if not found:
         # Try fuzzy match for symptoms too
         for word in text.split():
-            matches = difflib.get_close_matches(word, SYMPTOMS_DB.keys(), n=1, cutoff=0.8)
-            if matches:
-                symptom = matches[0]
-                if (symptom, SYMPTOMS_DB[symptom]) not in detected_symptoms:
-                    detected_symptoms.append((symptom, SYMPTOMS_DB[symptom]))
+            matches = difflib.get_close_matches(word, symptom_keys, n=1, cutoff=0.8)
+            if matches and matches[0] not in found:
+                found.append(matches[0])
+
+    return found
 
-    if not detected_symptoms:
+def describe_symptoms(symptoms: list) -> str:
+    """Build advice text for already-detected symptoms."""
+    if not symptoms:
         return None
-        
+
     response = ""
-    for symptom, data in detected_symptoms:
+    for symptom in symptoms:
+        data = SYMPTOMS_DB[symptom]
         response += f"Symptom: {symptom.capitalize()}\n"
         response += f"Possible Causes: {', '.join(data['possible_causes'])}\n"
         response += f"Home Care: {data['recommendations']}\n"
         response += f"Red Flags: {data['red_flags']}\n\n"
-        
+
     return response
 
+@profiled
+def analyze_symptoms(text: str) -> str:
+    """Analyze text for symptoms and provide advice."""
+    return describe_symptoms(find_symptoms(text))
+
 def openfda_lookup(name: str) -> Optional[Dict[str, str]]:
+    # Label lookups are shared across server processes; an empty dict records "no label found"
+    cached = cache_get("openfda", name)
+    if cached is not None:
+        return cached or None
     if not requests:
         return None
     try:
         q = name.replace(" ", "+")
         url = f"https://api.fda.gov/drug/label.json?search=openfda.brand_name:{q}+openfda.generic_name:{q}&limit=1"
         r = requests.get(url, timeout=8)
+        if r.status_code == 404:
+            # openFDA answers "no match" with a 404
+            cache_set("openfda", name, {})
+            return None
         if r.status_code != 200:
             return None
         data = r.json()
         results = data.get("results")
         if not results:
+            cache_set("openfda", name, {})
             return None
         doc = results[0]
         info = {}
@@ -179,13 +235,21 @@ def openfda_lookup(name: str) -> Optional[Dict[str, str]]:
         info["warnings"] = get_field("warnings") or ""
         info["contraindications"] = get_field("contraindications") or ""
         info["adverse_reactions"] = get_field("adverse_reactions") or ""
+        cache_set("openfda", name, info)
         return info
     except Exception:
         return None
 
+@profiled
 def get_medication_details(name: str, profile: dict = None) -> str:
     """Get detailed info for a medication, optionally checking profile warnings."""
-    data = MEDICATIONS.get(name)
+    if name not in get_formulary_index()["records"]:
+        return None
+    return medication_details(name, openfda_lookup(name), profile)
+
+def medication_details(name: str, fda: Optional[Dict[str, str]], profile: dict = None) -> str:
+    """Format medication details using an openFDA label the caller already fetched."""
+    data = get_formulary_index()["records"].get(name)
     if not data:
         return None
     info = (
@@ -196,7 +260,6 @@ def get_medication_details(name: str, profile: dict = None) -> str:
         f"Contraindications: {data.get('contraindications', 'None listed')}\n"
         f"Possible Side Effects: {data['side_effects']}\n"
     )
-    fda = openfda_lookup(name)
     if fda:
         if fda.get("purpose"):
             info += f"\nFDA Purpose: {fda['purpose']}\n"
@@ -211,27 +274,33 @@ def get_medication_details(name: str, profile: dict = None) -> str:
     info += "\nA healthcare professional can decide whether this medicine is appropriate for you.\n"
     
     # Profile-based warnings
-    if profile:
-        warnings = []
-        age = profile.get("age")
-        conditions = normalize(profile.get("conditions", ""))
-        
-        if age and age < 12:
-            warnings.append(f"This medication may not be suitable for children (Age: {age}).")
-        if "liver" in conditions and "liver" in data.get("warnings", "").lower():
-             warnings.append("Health Alert: Use caution given your history of liver issues.")
-        if "kidney" in conditions and "kidney" in data.get("warnings", "").lower():
-             warnings.append("Health Alert: Use caution given your history of kidney issues.")
-        if "ulcer" in conditions and "stomach" in data.get("warnings", "").lower():
-             warnings.append("Health Alert: This medication can affect the stomach.")
-             
-        if warnings:
-            info += "\nPersonalized Alerts based on your profile:\n"
-            for w in warnings:
-                info += f"- {w}\n"
+    warnings = profile_alerts(data, profile)
+    if warnings:
+        info += "\nPersonalized Alerts based on your profile:\n"
+        for w in warnings:
+            info += f"- {w}\n"
                 
     return info
 
+def profile_alerts(data: dict, profile: dict = None) -> list:
+    """Warnings for a medication record that apply to the user's profile."""
+    warnings = []
+    if not profile:
+        return warnings
+    age = profile.get("age")
+    conditions = normalize(profile.get("conditions", ""))
+    
+    if age and age < 12:
+        warnings.append(f"This medication may not be suitable for children (Age: {age}).")
+    if "liver" in conditions and "liver" in data.get("warnings", "").lower():
+         warnings.append("Health Alert: Use caution given your history of liver issues.")
+    if "kidney" in conditions and "kidney" in data.get("warnings", "").lower():
+         warnings.append("Health Alert: Use caution given your history of kidney issues.")
+    if "ulcer" in conditions and "stomach" in data.get("warnings", "").lower():
+         warnings.append("Health Alert: This medication can affect the stomach.")
+    return warnings
+
+@profiled
 def infermedica_triage(user_input: str, profile: dict = None) -> Dict[str, str]:
     text = normalize(user_input)
     app_id = os.getenv("INFERMEDICA_APP_ID")
@@ -267,3 +336,154 @@ def infermedica_triage(user_input: str, profile: dict = None) -> Dict[str, str]:
     if symptoms:
         return {"level": "self_care", "source": "heuristic"}
     return {"level": "unknown", "source": "heuristic"}
+
+# Number of entities of each kind carried forward between chat turns
+MEMORY_WINDOW = 5
+
+def new_conversation_memory() -> dict:
+    return {"meds": [], "focus_meds": [], "symptoms": [], "triage": None, "med_details": {}, "profile_key": None}
+
+def turn_medications(memory: dict, text: str, found_meds: list, symptoms: list, wellness_advice: str) -> list:
+    """Medications a turn is about: those it names, or the previous focus for a follow-up.
+
+    A follow-up names no drug, symptom, topic or other subject ("what about side effects?",
+    "and contraindications?"); "...of the covid vaccine?" is not one.
+    """
+    if found_meds:
+        return list(found_meds)
+    if symptoms or wellness_advice or mentions_other_subject(text):
+        return []
+    return list(memory["focus_meds"])
+
+def remember(memory: dict, meds: list, symptoms: list, triage_level: str, focus_meds: list = None):
+    """Fold the entities detected in this turn into the rolling conversation memory.
+
+    `meds` are the medications named in this turn; `focus_meds` are those the turn was
+    about (see turn_medications) and default to `meds`.
+    """
+    for key, items in (("meds", meds), ("symptoms", symptoms)):
+        for item in items:
+            if item in memory[key]:
+                memory[key].remove(item)
+            memory[key].append(item)
+        del memory[key][:-MEMORY_WINDOW]
+    # Only medications still in the window keep their computed details
+    for med in list(memory["med_details"]):
+        if med not in memory["meds"]:
+            del memory["med_details"][med]
+    # Follow-ups keep referring to the same drugs until a turn moves on to something else
+    memory["focus_meds"] = list(meds if focus_meds is None else focus_meds)
+    if triage_level and triage_level != "unknown":
+        memory["triage"] = triage_level
+
+def summarize_conversation(memory: dict) -> str:
+    """Compact summary of earlier turns, used instead of resending their full context."""
+    parts = []
+    if memory["meds"]:
+        parts.append(f"medications discussed: {', '.join(memory['meds'])}")
+    if memory["symptoms"]:
+        parts.append(f"symptoms mentioned: {', '.join(memory['symptoms'])}")
+    if memory["triage"]:
+        parts.append(f"last triage level: {memory['triage']}")
+    if not parts:
+        return ""
+    return "Earlier in this conversation - " + "; ".join(parts) + "."
+
+# Lookup intents answerable directly from the medication records, checked in order
+LOOKUP_INTENTS = [
+    ("side_effects", ["side effect", "side effects", "adverse", "reactions"]),
+    ("interactions", ["interact", "interacts", "interaction", "interactions", "combine", "mix"]),
+    ("contraindications", ["contraindication", "contraindications", "who should not", "should not take"]),
+    ("warnings", ["warning", "warnings", "precaution", "precautions", "risks"]),
+    ("uses", ["used for", "use of", "uses"]),
+]
+# Question stems that ask what a drug is only when the drug name follows directly ("what is tylenol")
+DRUG_QUESTION_STEMS = [("what", "is"), ("what", "does"), ("what", "'s")]
+# Phrasings that ask for judgement rather than a lookup, so they always go to the LLM
+REASONING_CUES = ["should i", "can i", "is it ok", "why", "compare", "better", "instead", "pregnant", "while"]
+
+# Words a follow-up can be made of without naming a new subject ("what about its side effects?"),
+# in addition to the words of the LOOKUP_INTENTS phrases
+FOLLOW_UP_WORDS = {
+    "'s", "a", "about", "again", "also", "an", "and", "any", "are", "between", "can", "common", "do", "does", "drug", "else",
+    "for", "has", "have", "how", "i", "is", "it", "its", "known", "list", "main", "me", "medication",
+    "medicine", "more", "my", "not", "of", "other", "please", "possible", "serious", "so", "tell", "that",
+    "the", "their", "them", "then", "there", "these", "they", "this", "those", "what", "which",
+    "with", "who", "take", "taking",
+}
+
+def mentions_other_subject(text: str) -> bool:
+    """True if the text names something beyond follow-up filler, e.g. "the covid vaccine"."""
+    allowed = FOLLOW_UP_WORDS | {w for _, phrases in LOOKUP_INTENTS for p in phrases for w in p.split()}
+    return any(word not in allowed for word in tokenize(text))
+
+def contains_phrase(text: str, phrase: str) -> bool:
+    return f" {phrase} " in f" {text} "
+
+def classify_intent(text: str) -> str:
+    """Rule-based intent: one of the LOOKUP_INTENTS names, or "general" for free-form questions."""
+    text = normalize(text)
+    if any(contains_phrase(text, cue) for cue in REASONING_CUES):
+        return "general"
+    matcher = get_formulary_index()["matcher"]
+    # A template only answers the bare lookup; any qualifier left once the drug names are
+    # removed ("... during pregnancy", "... in children") needs the LLM
+    if mentions_other_subject(matcher.sub(" ", text)):
+        return "general"
+    for intent, phrases in LOOKUP_INTENTS:
+        if any(contains_phrase(text, p) for p in phrases):
+            return intent
+    for match in matcher.finditer(text):
+        preceding = tuple(text[:match.start()].split())
+        if any(preceding[-len(stem):] == stem for stem in DRUG_QUESTION_STEMS):
+            return "uses"
+    return "general"
+
+def render_lookup(intent: str, meds: list, profile: dict = None) -> Optional[str]:
+    """Answer a lookup intent from the structured records, or None if it cannot be templated."""
+    records = get_formulary_index()["records"]
+    sections = []
+    for name in meds:
+        data = records.get(name)
+        if not data:
+            return None
+        title = f"**{name.capitalize()}** ({data.get('category', 'Unknown')})"
+        if intent == "side_effects":
+            body = f"Possible side effects: {data['side_effects']}"
+        elif intent == "interactions":
+            body = f"Known to interact with: {', '.join(data.get('interactions', [])) or 'none listed'}"
+        elif intent == "contraindications":
+            body = f"Contraindications: {data.get('contraindications', 'None listed')}"
+        elif intent == "warnings":
+            body = f"Warnings: {data['warnings']}\n\nContraindications: {data.get('contraindications', 'None listed')}"
+        elif intent == "uses":
+            body = f"Uses: {data['uses']}"
+        elif intent == "overview":
+            body = (
+                f"Uses: {data['uses']}\n\nWarnings: {data['warnings']}\n\n"
+                f"Possible side effects: {data['side_effects']}"
+            )
+        else:
+            return None
+        section = f"{title}\n\n{body}"
+        alerts = profile_alerts(data, profile)
+        if alerts:
+            section += "\n\nPersonalized Alerts based on your profile:\n" + "\n".join(f"- {a}" for a in alerts)
+        sections.append(section)
+    if not sections:
+        return None
+    return "\n\n".join(sections) + "\n\nA healthcare professional can decide whether this medicine is appropriate for you."
+
+ROUTE_COUNTS = Counter()
+_route_lock = threading.Lock()
+
+def record_route(route: str, intent: str):
+    """Count and log whether a chat turn was answered by a template or the LLM."""
+    with _route_lock:
+        ROUTE_COUNTS[route] += 1
+        avoided = ROUTE_COUNTS["template"]
+        total = sum(ROUTE_COUNTS.values())
+    logger.info(
+        "route=%s intent=%s llm_calls_avoided=%d/%d (%.0f%%)",
+        route, intent, avoided, total, 100 * avoided / total
+    )